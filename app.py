@@ -1,5 +1,4 @@
-cat > app.py <<'PY'
-# app.py — FFmpeg API (Cloud Run) - concat demuxer + mix opcional de áudio
+# app.py — FFmpeg API (Cloud Run) - concat (filter_complex) + mix opcional de áudio
 # ------------------------------------------------------------
 # Endpoints:
 #   GET  /             -> {"message":"FFmpeg API online","status":"ok"}
@@ -7,6 +6,7 @@ cat > app.py <<'PY'
 #   GET  /healthz      -> {"status":"ok"}
 #   POST /concat_and_upload   -> assíncrono (retorna 202)
 #   POST /concat_sync         -> síncrono (retorna 200/500)
+#   GET  /status/<job_id>     -> estado de um job assíncrono (queued/running/done/error)
 #
 # Payload JSON (para ambos):
 # {
@@ -18,8 +18,10 @@ cat > app.py <<'PY'
 #   "fps": 30,                                # opcional (env DEFAULT_FPS)
 #   "video_bitrate": "4M",                    # opcional (env DEFAULT_VIDEO_BR)
 #   "audio_bitrate": "192k",                  # opcional (env DEFAULT_AUDIO_BR)
+#   "preset": "veryfast",                     # opcional, só libx264 (env X264_PRESET)
 #   "audio_url": "https://.../bgm.mp3",       # opcional (BGM/narração)
 #   "audio_gain": 0.2,                        # opcional (0.0–5.0) volume linear
+#   "audio_loop": false,                      # opcional: repete o áudio até o fim do vídeo
 #   "output_name": "final.mp4",               # opcional
 #   "upload": false,                          # opcional (env UPLOAD_TO_DRIVE)
 #   "drive_folder_id": "..."                  # obrigatório se upload=true
@@ -32,12 +34,40 @@ import shutil
 import threading
 import tempfile
 import subprocess
+import functools
+import json
+import time
+import hashlib
+import queue
+import collections
+import logging
+import shlex
+import sys
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask, request, jsonify
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 app = Flask(__name__)
 
+# Logs em stdout (Cloud Logging lê de lá), formatação preguiçosa com %s: a string
+# só é montada se o nível estiver habilitado (LOG_LEVEL=DEBUG inclui os comandos)
+log = logging.getLogger("ffapi")
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter("%(message)s"))
+log.addHandler(_log_handler)
+log.propagate = False
+_log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+if _log_level in logging.getLevelNamesMapping():
+    log.setLevel(_log_level)
+else:
+    # Nível desconhecido não pode derrubar o boot (--preload importa o app no master)
+    log.setLevel(logging.INFO)
+    log.warning("[boot] LOG_LEVEL inválido (%s), usando INFO", _log_level)
+
 # =========================
 # Configurações (ENV)
 # =========================
@@ -47,36 +77,326 @@ DEFAULT_VIDEO_BR   = os.getenv("DEFAULT_VIDEO_BR", "4M")
 DEFAULT_AUDIO_BR   = os.getenv("DEFAULT_AUDIO_BR", "192k")
 UPLOAD_TO_DRIVE    = os.getenv("UPLOAD_TO_DRIVE", "false").lower() == "true"
 DRIVE_FOLDER_ID    = os.getenv("DRIVE_FOLDER_ID", "")  # usado somente se upload=true
+# Upload resumable em partes de N MiB (a API exige múltiplos de 256 KiB): menos PUTs por arquivo
+DRIVE_CHUNK_SIZE   = int(os.getenv("DRIVE_CHUNK_MB", "32")) * 1024 * 1024
+DOWNLOAD_WORKERS   = int(os.getenv("DOWNLOAD_WORKERS", "16"))  # downloads simultâneos por job
+DOWNLOAD_PARTS     = int(os.getenv("DOWNLOAD_PARTS", "4"))  # Ranges paralelos por arquivo grande (1 = desliga)
+STREAM_INPUTS      = os.getenv("STREAM_INPUTS", "true").lower() == "true"  # ffmpeg lê http(s) direto
+ENCODER            = os.getenv("ENCODER", "auto")  # auto | h264_nvenc | h264_vaapi | h264_qsv | h264_amf | libx264
+VAAPI_DEVICE       = os.getenv("VAAPI_DEVICE", "/dev/dri/renderD128")
+PIPELINE_WORKERS   = int(os.getenv("PIPELINE_WORKERS", "2"))  # jobs assíncronos rodando ao mesmo tempo
+QUEUE_DEPTH        = int(os.getenv("QUEUE_DEPTH", "32"))  # jobs aceitos (fila + rodando); acima disso 429
+JOB_TTL_SECONDS    = int(os.getenv("JOB_TTL_SECONDS", "3600"))  # jobs finalizados ficam no /status por esse tempo
+CLIP_CACHE_DIR     = os.getenv("CLIP_CACHE_DIR", "")  # ex.: /var/cache/ffapi (vazio = sem cache)
+CLIP_CACHE_TTL_DAYS = int(os.getenv("CLIP_CACHE_TTL_DAYS", "7"))
+CLIP_CACHE_MAX_MB  = int(os.getenv("CLIP_CACHE_MAX_MB", "10240"))  # teto do cache (0 = sem teto)
+X264_PRESET        = os.getenv("X264_PRESET", "veryfast")
+X264_TUNE          = os.getenv("X264_TUNE", "zerolatency")  # vazio = sem -tune
+X264_PARAMS        = os.getenv("X264_PARAMS", "sliced-threads=1:sync-lookahead=0:rc-lookahead=10")
+FFMPEG_THREADS     = int(os.getenv("FFMPEG_THREADS", "0"))  # 0 = vCPUs do container / PIPELINE_WORKERS
+FUSED_MAX_INPUTS   = int(os.getenv("FUSED_MAX_INPUTS", "8"))  # acima disso normaliza clip a clip
+NORMALIZE_WORKERS  = int(os.getenv("NORMALIZE_WORKERS", "0"))  # clips normalizados em paralelo (0 = auto)
+FFMPEG_LOGLEVEL    = os.getenv("FFMPEG_LOGLEVEL", "error")  # info gera MBs de stderr em encodes longos
+MAX_TOTAL_BYTES    = int(os.getenv("MAX_TOTAL_BYTES", str(2 * 1024**3)))  # soma das entradas (0 = sem limite)
+MAX_INPUT_BYTES    = int(os.getenv("MAX_INPUT_BYTES", str(1024**3)))  # por entrada (0 = sem limite)
+# Binários resolvidos uma vez no import (nenhuma busca no PATH por exec);
+# FFMPEG_BIN/FFPROBE_BIN no env apontam para outro build
+FFMPEG_BIN         = os.getenv("FFMPEG_BIN") or shutil.which("ffmpeg")
+FFPROBE_BIN        = os.getenv("FFPROBE_BIN") or shutil.which("ffprobe")
+# Intermediários em tmpfs (RAM) quando houver; FFAPI_TMP força outro diretório
+TMP_BASE           = os.getenv("FFAPI_TMP") or (
+    "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+)
+
+# Sessão HTTP compartilhada (thread-safe para requests distintos): reaproveita
+# conexões/handshakes TLS entre downloads e jobs, com retry em falhas de conexão
+HTTP = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=DOWNLOAD_WORKERS,
+    pool_maxsize=DOWNLOAD_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+)
+HTTP.mount("http://", _http_adapter)
+HTTP.mount("https://", _http_adapter)
+
+# Jobs (/concat_and_upload e /concat_sync): pool fixo de workers (nada de thread por
+# request, no máximo PIPELINE_WORKERS pipelines ao mesmo tempo) e estado de cada job
+# assíncrono em memória para o /status
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="job")
+JOBS: dict[str, dict] = {}
+JOBS_LOCK = threading.Lock()
+# Vagas de jobs pendentes: a fila do executor não tem limite, então o limite é aqui
+JOB_SLOTS = threading.BoundedSemaphore(QUEUE_DEPTH)
+
+# ffprobe por fonte (URL + ETag), compartilhado entre jobs; limitado por tamanho
+PROBE_CACHE: dict[str, dict] = {}
+PROBE_CACHE_MAX = 1024
+PROBE_LOCK = threading.Lock()
 
 # =========================
 # Helpers
 # =========================
 def ffmpeg_exists() -> bool:
-    from shutil import which
-    return which("ffmpeg") is not None
+    # Não muda durante a vida do processo: resolvido uma vez no import (FFMPEG_BIN)
+    return FFMPEG_BIN is not None
 
-def run(cmd: list[str]) -> None:
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+def run(cmd: list[str], entrada: bytes | None = None) -> None:
+    # stdout descartado (ffmpeg só escreve no arquivo de saída); stderr lido linha a
+    # linha e só as últimas 40 ficam em memória, qualquer que seja a duração do encode.
+    # Em bytes: só o final é decodificado, e só se der erro. `entrada` vai pelo stdin
+    if cmd and cmd[0] == FFMPEG_BIN:
+        cmd = [cmd[0], "-hide_banner", "-loglevel", FFMPEG_LOGLEVEL, *cmd[1:]]
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("[run] %s", shlex.join(cmd))
+    with subprocess.Popen(
+        cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, bufsize=1 << 20,
+        stdin=subprocess.PIPE if entrada is not None else None,
+    ) as p:
+        if entrada is not None:
+            try:
+                p.stdin.write(entrada)
+                p.stdin.close()
+            except BrokenPipeError:
+                pass  # ffmpeg saiu antes de ler; o erro vem no stderr
+        tail = collections.deque(p.stderr, maxlen=40)
     if p.returncode != 0:
-        raise RuntimeError(f"FFmpeg/Proc error ({p.returncode}):\n{p.stderr}")
+        msg = b"".join(tail).decode("utf-8", errors="replace")
+        raise RuntimeError(f"FFmpeg/Proc error ({p.returncode}):\n{msg}")
 
-def download(url: str, to_path: str) -> None:
-    with requests.get(url, stream=True, timeout=60) as r:
+# Abaixo disso um GET único já satura o link; acima, o arquivo é baixado em partes
+DOWNLOAD_PART_MIN = 32 * 1024 * 1024
+
+def download(url: str, to_path: str, head: requests.Response | None = None) -> None:
+    tamanho = _content_length(head)
+    if (
+        DOWNLOAD_PARTS > 1 and tamanho >= DOWNLOAD_PART_MIN
+        and head.headers.get("Accept-Ranges", "").lower() == "bytes"
+    ):
+        if _download_em_partes(url, to_path, tamanho):
+            return
+        # CDN/proxy anuncia Range no HEAD mas responde 200 no GET: um GET só
+        log.warning("[download] Range ignorado no GET, baixando inteiro: %s", url)
+
+    # Cópia direta do socket (r.raw) com buffer de 8 MiB: nada de um ciclo Python
+    # por chunk; decode_content mantém a descompressão gzip/deflate se houver
+    with HTTP.get(url, stream=True, timeout=(10, 120)) as r:
         r.raise_for_status()
+        r.raw.decode_content = True
         with open(to_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 1024):
-                if chunk:
-                    f.write(chunk)
+            _prealocar(f, tamanho)
+            shutil.copyfileobj(r.raw, f, length=8 * 1024 * 1024)
+            f.truncate()  # a reserva pode passar do que chegou de fato
+
+def _prealocar(f, tamanho: int) -> None:
+    # Reserva os blocos de uma vez (extents contíguos, ENOSPC logo no início em vez
+    # de no meio do download); FS sem suporte só segue sem reserva
+    if tamanho <= 0:
+        return
+    try:
+        os.posix_fallocate(f.fileno(), 0, tamanho)
+    except (AttributeError, OSError):
+        pass
+
+def _download_em_partes(url: str, to_path: str, tamanho: int) -> bool:
+    """
+    DOWNLOAD_PARTS GETs com Range em paralelo, cada um gravando direto no seu offset
+    do arquivo pré-alocado: arquivos grandes deixam de depender do throughput de uma
+    única conexão TCP. Retorna False (e cancela as outras partes) se o servidor
+    responder sem 206, para o chamador baixar com um GET só.
+    """
+    passo = -(-tamanho // DOWNLOAD_PARTS)
+    with open(to_path, "wb") as f:
+        _prealocar(f, tamanho)
+        f.truncate(tamanho)
+    cancelado = threading.Event()
+
+    def parte(inicio: int) -> None:
+        if cancelado.is_set():
+            return
+        fim = min(inicio + passo, tamanho) - 1
+        headers = {"Range": f"bytes={inicio}-{fim}"}
+        try:
+            with HTTP.get(url, stream=True, timeout=(10, 120), headers=headers) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    cancelado.set()
+                    return
+                with open(to_path, "r+b") as f:
+                    f.seek(inicio)
+                    # Blocos de 8 MiB: entre um e outro a parte vê o cancelamento
+                    while not cancelado.is_set() and (buf := r.raw.read(8 * 1024 * 1024)):
+                        f.write(buf)
+                    if not cancelado.is_set() and f.tell() != fim + 1:
+                        raise RuntimeError(f"download incompleto ({inicio}-{fim}): {url}")
+        except Exception:
+            cancelado.set()  # erro numa parte derruba as outras logo
+            raise
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_PARTS, thread_name_prefix="range") as ex:
+        list(ex.map(parte, range(0, tamanho, passo)))
+    return not cancelado.is_set()
+
+@functools.lru_cache(maxsize=1)
+def _drive():
+    """
+    (credenciais, service do Drive), criados uma vez por processo: o build() faz o
+    parse do documento de discovery, e as credenciais padrão do ambiente (service
+    account do Cloud Run ou GOOGLE_APPLICATION_CREDENTIALS) se renovam sozinhas.
+    """
+    # Import tardio: as libs do Google só são carregadas se houver upload
+    import google.auth
+    from googleapiclient.discovery import build
+
+    creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/drive.file"])
+    return creds, build("drive", "v3", credentials=creds, cache_discovery=False)
 
 def upload_to_drive(local_path: str, name: str, folder_id: str) -> dict:
-    # Stub seguro (trocar pela integração real depois)
-    return {
-        "id": "fake-id",
-        "name": name,
-        "webViewLink": "https://drive.google.com/",
-        "webContentLink": "https://drive.google.com/",
-    }
+    """
+    Upload resumable para o Drive. O arquivo sobe em partes de DRIVE_CHUNK_SIZE
+    direto do disco, sem carregar o vídeo em memória; uma falha transitória repete
+    só a parte corrente, não o arquivo inteiro.
+    """
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.http import MediaFileUpload
+
+    creds, service = _drive()
+    # O service é compartilhado, mas o httplib2 não é thread-safe: cada upload usa
+    # a sua própria conexão autorizada
+    http = AuthorizedHttp(creds, http=httplib2.Http())
+    media = MediaFileUpload(
+        local_path, mimetype="video/mp4", chunksize=DRIVE_CHUNK_SIZE, resumable=True
+    )
+    req = service.files().create(
+        body={"name": name, "parents": [folder_id]},
+        media_body=media,
+        fields="id,name,webViewLink,webContentLink",
+        supportsAllDrives=True,
+    )
+    resposta = None
+    while resposta is None:
+        _, resposta = req.next_chunk(http=http, num_retries=3)
+    return resposta
 
+@functools.lru_cache(maxsize=None)
+def _encoder_funciona(encoder: str) -> bool:
+    """
+    Testa o encoder com um encode minúsculo: "ffmpeg -encoders" lista h264_nvenc
+    mesmo sem GPU/driver, então só um encode real diz se ele está utilizável.
+    """
+    if encoder == "h264_vaapi" and not os.path.exists(VAAPI_DEVICE):
+        return False
+    cmd = [
+        FFMPEG_BIN, "-hide_banner", "-loglevel", "error",
+        *_opcoes_hw_device(encoder),
+        "-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1",
+    ]
+    if _vf_upload(encoder):
+        cmd += ["-vf", _vf_upload(encoder)]
+    cmd += ["-c:v", encoder, "-f", "null", "-"]
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=30).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+# Ordem de preferência na detecção automática (ENCODER=auto)
+_ENCODERS_HW = ("h264_nvenc", "h264_vaapi", "h264_qsv", "h264_amf")
+
+@functools.lru_cache(maxsize=1)
+def _video_encoder() -> str:
+    if ENCODER == "auto":
+        for encoder in _ENCODERS_HW:
+            if _encoder_funciona(encoder):
+                log.info("[encoder] usando %s", encoder)
+                return encoder
+        return "libx264"
+    if ENCODER != "libx264" and not _encoder_funciona(ENCODER):
+        log.warning("[encoder] %s indisponível, usando libx264", ENCODER)
+        return "libx264"
+    return ENCODER
+
+def _opcoes_hw_device(encoder: str) -> tuple[str, ...]:
+    # Opção global (antes das entradas): o device VAAPI usado pelo hwupload/encoder
+    if encoder == "h264_vaapi":
+        return ("-vaapi_device", VAAPI_DEVICE)
+    return ()
+
+def _vf_upload(encoder: str) -> str:
+    # h264_vaapi só aceita frames na GPU: o scale/pad continua em CPU e o resultado
+    # sobe para uma superfície VAAPI no fim da cadeia de filtros
+    if encoder == "h264_vaapi":
+        return "format=nv12,hwupload"
+    return ""
+
+def _opcoes_decode(encoder: str) -> list[str]:
+    # Com encoder de hardware o decode também vai para a GPU (NVDEC/VAAPI); os frames
+    # voltam para a memória do host para o scale/pad em CPU (pad_cuda/pad_vaapi não
+    # existem em todo build do ffmpeg). Codec sem suporte cai no decode em software
+    if encoder == "h264_nvenc":
+        return ["-hwaccel", "cuda"]
+    if encoder == "h264_vaapi":
+        return ["-hwaccel", "vaapi"]
+    return []
+
+@functools.lru_cache(maxsize=1)
+def _cpus_disponiveis() -> int:
+    """
+    vCPUs realmente disponíveis: no Cloud Run os.cpu_count() enxerga o host inteiro,
+    o limite do container vem da quota do cgroup (cpu.max).
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max", encoding="utf-8") as f:
+            quota, periodo = f.read().split()[:2]
+        if quota != "max":
+            return max(1, int(int(quota) / int(periodo)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        return os.cpu_count() or int(os.environ.get("CLOUD_RUN_CPU", "2"))
+
+X264_PRESETS = (
+    "ultrafast", "superfast", "veryfast", "faster", "fast",
+    "medium", "slow", "slower", "veryslow", "placebo",
+)
+
+def _cpus_por_job() -> int:
+    # Até PIPELINE_WORKERS jobs encodam ao mesmo tempo: cada um fica com a sua fatia,
+    # sem N jobs x vCPUs threads disputando os mesmos núcleos
+    return max(1, _cpus_disponiveis() // PIPELINE_WORKERS)
+
+@functools.lru_cache(maxsize=64)
+def _opcoes_encoder(
+    encoder: str, vbr: str, threads: int = 0, preset: str = ""
+) -> tuple[str, ...]:
+    if encoder == "h264_nvenc":
+        return ("-c:v", "h264_nvenc", "-preset", "p4", "-tune", "hq", "-rc", "vbr", "-b:v", vbr,
+                "-pix_fmt", "yuv420p")
+    if encoder == "h264_vaapi":
+        # pix_fmt vem do hwupload (nv12 na superfície VAAPI)
+        return ("-c:v", "h264_vaapi", "-b:v", vbr)
+    if encoder == "h264_qsv":
+        # QSV aceita nv12 da memória do host: sem hwupload no filtro
+        return ("-c:v", "h264_qsv", "-preset", "veryfast", "-b:v", vbr, "-pix_fmt", "nv12")
+    if encoder == "h264_amf":
+        return ("-c:v", "h264_amf", "-usage", "transcoding", "-quality", "speed", "-rc", "cbr",
+                "-b:v", vbr, "-pix_fmt", "yuv420p")
+    if encoder != "libx264":
+        return ("-c:v", encoder, "-b:v", vbr, "-pix_fmt", "yuv420p")
+
+    # libx264: threads = fatia de vCPUs do job (o "auto" do x264 superdimensiona e cada
+    # frame-thread segura frames de referência); sliced-threads e lookahead curto
+    # cortam memória por encode
+    threads = threads or FFMPEG_THREADS or _cpus_por_job()
+    cmd = ["-c:v", "libx264", "-preset", preset or X264_PRESET, "-threads", str(threads)]
+    if X264_TUNE:
+        cmd += ["-tune", X264_TUNE]
+    if X264_PARAMS:
+        cmd += ["-x264-params", X264_PARAMS]
+    return (*cmd, "-b:v", vbr, "-pix_fmt", "yuv420p")
+
+@functools.lru_cache(maxsize=16)
 def _parse_res(res: str) -> tuple[int, int]:
     """
     Aceita "1080x1920" ou "1080:1920" e retorna (w, h) inteiros.
@@ -90,99 +410,560 @@ def _parse_res(res: str) -> tuple[int, int]:
         raise ValueError(f"resolution inválida: {res}")
     return int(w), int(h)
 
+def _flag(valor, padrao: bool) -> bool:
+    """
+    Booleano do payload: true/false do JSON ou as strings "true"/"false" (o n8n
+    costuma mandar strings); bool("false") seria True. ValueError no resto.
+    """
+    if valor is None:
+        return padrao
+    if isinstance(valor, bool):
+        return valor
+    if isinstance(valor, str) and valor.strip().lower() in ("true", "false"):
+        return valor.strip().lower() == "true"
+    raise ValueError(f"booleano inválido: {valor!r}")
+
 # =========================
 # Núcleo de vídeo/áudio
 # =========================
-def _baixar_videos_normalizar_sem_audio(
-    clips: list[dict], tmpdir: str, resolution: str, fps: int, vbr: str, abr: str
-) -> list[str]:
-    local_videos = []
+def _is_http(url: str) -> bool:
+    return url.lower().startswith(("http://", "https://"))
+
+def _opcoes_entrada(src: str) -> list[str]:
+    """
+    Opções de entrada para fontes remotas: o protocolo http do ffmpeg reconecta
+    sozinho se a conexão com o CDN cair no meio do arquivo, e -rw_timeout (30 s)
+    evita que uma conexão travada segure o job para sempre. -thread_queue_size
+    folgado absorve a oscilação da rede sem travar as outras entradas do grafo.
+    """
+    if not _is_http(src):
+        return []
+    return [
+        "-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5",
+        "-rw_timeout", "30000000", "-thread_queue_size", "1024",
+    ]
+
+def _head(url: str) -> requests.Response | None:
+    try:
+        return HTTP.head(url, allow_redirects=True, timeout=10)
+    except requests.RequestException:
+        return None
+
+def _chave_fonte(url: str, head: requests.Response | None) -> str | None:
+    # Identidade de uma fonte remota: URL + ETag (+ Content-Length); None sem ETag
+    if head is None or not head.ok:
+        return None
+    etag = head.headers.get("ETag")
+    if not etag:
+        return None
+    return f"{url}|{etag}|{head.headers.get('Content-Length', '')}"
+
+def _cache_get(url: str, head: requests.Response | None) -> str | None:
+    """
+    Cache local de fontes, endereçado por URL + ETag (+ Content-Length): clips e BGMs
+    repetidos entre jobs (intros, outros, trilhas) são baixados uma vez só. Na falta
+    o arquivo é baixado num .tmp e promovido com os.replace (atômico).
+    """
+    chave = _chave_fonte(url, head)
+    if not CLIP_CACHE_DIR or not chave:
+        return None
+
+    path = os.path.join(CLIP_CACHE_DIR, hashlib.sha256(chave.encode()).hexdigest() + ".bin")
+    if os.path.exists(path):
+        os.utime(path)  # renova o TTL
+        return path
+
+    os.makedirs(CLIP_CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        download(url, tmp, head)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+def _cache_norm_path(
+    url: str, head: requests.Response | None, clip: dict,
+    resolution: str, fps: int, vbr: str, preset: str
+) -> str | None:
+    """
+    Caminho no cache do clip já normalizado (modo segmentado): mesma fonte (URL +
+    ETag) com o mesmo corte e perfil de saída reaproveita o norm_i.mp4 de um job
+    anterior, sem download nem encode. None se não houver cache ou ETag.
+    """
+    fonte = _chave_fonte(url, head)
+    if not CLIP_CACHE_DIR or not fonte:
+        return None
+
+    encoder = _video_encoder()
+    perfil = [resolution, fps, vbr, encoder]
+    if encoder == "libx264":
+        perfil += [preset or X264_PRESET, X264_TUNE, X264_PARAMS]
+    # "t=": "to" como duração; segmentos cortados com -to absoluto não são reaproveitados
+    corte = [clip.get("ss") or "", "t=" + str(clip.get("to") or "")]
+    chave = "|".join(map(str, [fonte, *corte, *perfil]))
+    return os.path.join(CLIP_CACHE_DIR, hashlib.sha256(chave.encode()).hexdigest() + ".norm.mp4")
+
+# Expiração roda no boot e depois no início dos jobs, no máximo uma vez por intervalo;
+# entradas tocadas há menos que isso contam como em uso e não saem pelo teto
+CACHE_EVICT_INTERVAL = 600
+_cache_evict_lock = threading.Lock()
+_cache_evict_ultimo = 0.0
+
+def _cache_evict() -> None:
+    """
+    Remove entradas sem uso há mais de CLIP_CACHE_TTL_DAYS (e .tmp órfãos); depois,
+    se o cache passar de CLIP_CACHE_MAX_MB, as menos usadas recentemente (o mtime é
+    renovado a cada acerto) até voltar ao teto.
+    """
+    if not CLIP_CACHE_DIR or not os.path.isdir(CLIP_CACHE_DIR):
+        return
+    agora = time.time()
+    limite = agora - CLIP_CACHE_TTL_DAYS * 86400
+    entradas = []
+    for entry in os.scandir(CLIP_CACHE_DIR):
+        try:
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+            if st.st_mtime < limite:
+                os.remove(entry.path)
+            elif not entry.name.endswith(".tmp"):
+                entradas.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            pass
+
+    teto = CLIP_CACHE_MAX_MB * 1024 * 1024
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    if not teto or total <= teto:
+        return
+    for mtime, tamanho, path in sorted(entradas):
+        if total <= teto or mtime > agora - CACHE_EVICT_INTERVAL:
+            break
+        try:
+            os.remove(path)
+            total -= tamanho
+        except OSError:
+            pass
+    if total > teto:
+        log.warning("[cache] %s bytes em uso recente acima do teto de %s MiB", total, CLIP_CACHE_MAX_MB)
+
+def _cache_evict_periodico() -> None:
+    # Chamado no início de cada job: o boot só roda no master (--preload) e um
+    # container de vida longa nunca mais expiraria nada
+    global _cache_evict_ultimo
+    if not CLIP_CACHE_DIR or time.time() - _cache_evict_ultimo < CACHE_EVICT_INTERVAL:
+        return
+    if not _cache_evict_lock.acquire(blocking=False):
+        return
+    _cache_evict_ultimo = time.time()
+
+    def rodar() -> None:
+        try:
+            _cache_evict()
+        finally:
+            _cache_evict_lock.release()
+
+    threading.Thread(target=rodar, daemon=True).start()
+
+def _fonte(url: str, local_path: str, head: requests.Response | None) -> str:
+    """
+    Fonte para o ffmpeg: o arquivo do cache quando houver (CLIP_CACHE_DIR), a própria
+    URL quando dá para ler por streaming, senão o arquivo baixado em local_path.
+    """
+    cached = _cache_get(url, head)
+    if cached:
+        return cached
+
+    # O ffmpeg precisa de Range para achar o moov de um mp4 remoto
+    if (STREAM_INPUTS and head is not None and head.ok
+            and head.headers.get("Accept-Ranges", "").lower() == "bytes"):
+        return url
+
+    download(url, local_path, head)
+    return local_path
+
+def _urls_dos_clips(clips: list[dict]) -> list[str]:
+    urls = []
     for i, clip in enumerate(clips):
         url = clip.get("source_url") or clip.get("url")
         if not url:
             raise ValueError(f"clip[{i}] sem 'source_url'/'url' no payload")
-        local_path = os.path.join(tmpdir, f"clip_{i}.mp4")
-        download(url, local_path)
-        local_videos.append({"path": local_path, "ss": clip.get("ss"), "to": clip.get("to")})
+        urls.append(url)
+    return urls
 
-    # Converte "1080x1920" -> (1080,1920) e monta filtro correto com ':'
-    w, h = _parse_res(resolution)
-    vf = (
-        f"scale={w}:{h}:force_original_aspect_ratio=decrease,"
-        f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2:color=black,"
-        f"setsar=1"
-    )
+def _heads(urls: list[str]) -> list[requests.Response | None]:
+    # Um HEAD por URL, em paralelo (reaproveitado para cache, Range e tamanho)
+    workers = max(1, min(len(urls), DOWNLOAD_WORKERS))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(lambda u: _head(u) if _is_http(u) else None, urls))
 
-    norm_paths = []
-    for i, c in enumerate(local_videos):
-        norm = os.path.join(tmpdir, f"norm_{i}.mp4")
-        cmd = ["ffmpeg", "-y"]
-        if c.get("ss"):
-            cmd += ["-ss", str(c["ss"])]
-        cmd += ["-i", c["path"]]
-        if c.get("to"):
-            cmd += ["-to", str(c["to"])]
+def _content_length(head: requests.Response | None) -> int:
+    try:
+        return int(head.headers.get("Content-Length", 0)) if head is not None and head.ok else 0
+    except ValueError:
+        return 0
 
-        cmd += [
-            "-vf", vf,
-            "-r", str(fps),
-            "-c:v", "libx264",
-            "-b:v", vbr,
-            "-pix_fmt", "yuv420p",
-            "-an",
-            norm
-        ]
-        run(cmd)
-        norm_paths.append(norm)
+def _tmp_base(bytes_estimados: int | None) -> str:
+    """
+    TMP_BASE (tmpfs) se couber o job; senão o tempdir padrão do sistema. Sem
+    estimativa (None: alguma entrada sem tamanho conhecido) vai direto para o
+    disco: o /dev/shm de um container comum tem só 64 MiB.
+    """
+    if TMP_BASE == tempfile.gettempdir():
+        return TMP_BASE
+    if bytes_estimados is None:
+        log.info("[worker] tamanho das entradas desconhecido, usando disco")
+        return tempfile.gettempdir()
+    try:
+        st = os.statvfs(TMP_BASE)
+    except OSError:
+        return tempfile.gettempdir()
+    if st.f_bavail * st.f_frsize < bytes_estimados:
+        log.warning("[worker] %s sem espaço para ~%s bytes, usando disco", TMP_BASE, bytes_estimados)
+        return tempfile.gettempdir()
+    return TMP_BASE
 
-    return norm_paths
+def _resolver_videos(
+    clips: list[dict], urls: list[str], heads: list[requests.Response | None], tmpdir: str
+) -> list[dict]:
+    """
+    Define a fonte ("src") de cada clip (ver _fonte). URLs http(s) com Range vão direto
+    para o ffmpeg, que decodifica enquanto os bytes chegam (rede e encode se
+    sobrepõem, sem cópia em disco); o resto (ou STREAM_INPUTS=false) é baixado antes.
+    """
+    # Downloads são I/O de rede: resolve todos em paralelo
+    workers = max(1, min(len(urls), DOWNLOAD_WORKERS))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(_resolver_clip, range(len(urls)), clips, urls, heads, [tmpdir] * len(urls)))
 
-def _concat_video_apenas_por_demuxer(norm_paths: list[str], tmpdir: str, output_name: str) -> str:
-    list_file = os.path.join(tmpdir, "inputs.txt")
-    with open(list_file, "w", encoding="utf-8") as f:
-        for p in norm_paths:
-            f.write(f"file '{p}'\n")
+def _resolver_clip(
+    i: int, clip: dict, url: str, head: requests.Response | None, tmpdir: str
+) -> dict:
+    # Nome pelo índice (não pela ordem de término) para preservar a ordem dos clips
+    src = _fonte(url, os.path.join(tmpdir, f"clip_{i}.mp4"), head)
+    return {"src": src, "ss": clip.get("ss"), "to": clip.get("to")}
 
-    concat_out = os.path.join(tmpdir, "concat.mp4")
-    run([
-        "ffmpeg", "-y",
-        "-f", "concat", "-safe", "0",
-        "-i", list_file,
-        "-c", "copy",
-        concat_out
-    ])
+def _probe(src: str) -> dict:
+    """
+    Primeiro stream de vídeo do arquivo/URL via ffprobe ({} se não der para ler).
+    -show_data_hash traz o hash do extradata (SPS/PPS) sem despejar o hexdump.
+    """
+    cmd = [
+        FFPROBE_BIN, "-v", "error", "-print_format", "json",
+        "-show_streams", "-show_data_hash", "sha256", "-select_streams", "v:0", src,
+    ]
+    try:
+        p = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        streams = json.loads(p.stdout or "{}").get("streams") or []
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return {}
+    return streams[0] if streams else {}
+
+def _probe_cacheado(src: str, chave: str | None) -> dict:
+    # Metadados de uma fonte (URL + ETag) não mudam: templates/intros repetidos entre
+    # jobs são sondados uma vez só
+    if chave:
+        with PROBE_LOCK:
+            if chave in PROBE_CACHE:
+                return PROBE_CACHE[chave]
+    st = _probe(src)
+    if chave and st:
+        with PROBE_LOCK:
+            if len(PROBE_CACHE) >= PROBE_CACHE_MAX:
+                PROBE_CACHE.pop(next(iter(PROBE_CACHE)))  # descarta o mais antigo
+            PROBE_CACHE[chave] = st
+    return st
+
+def _pode_copiar(
+    videos: list[dict], resolution: str, fps: int, chaves: list[str | None] | None = None
+) -> bool:
+    """
+    True quando dá para concatenar com -c copy, sem re-encode: nenhum clip tem corte
+    (ss/to) e todos já são H.264 yuv420p na resolução/fps pedidos, com o mesmo
+    timebase, profile/level, SAR e extradata (o concat demuxer grava um único avcC:
+    SPS/PPS diferentes entre clips corrompem as emendas). chaves[i] (_chave_fonte)
+    permite reaproveitar o ffprobe de jobs anteriores.
+    """
+    if not FFPROBE_BIN:
+        return False
+    if any(c.get("ss") or c.get("to") for c in videos):
+        return False
 
-    final_out = os.path.join(
+    workers = max(1, min(len(videos), DOWNLOAD_WORKERS))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        probes = list(ex.map(
+            _probe_cacheado, [c["src"] for c in videos], chaves or [None] * len(videos)
+        ))
+
+    w, h = _parse_res(resolution)
+    perfis = set()
+    for st in probes:
+        try:
+            fps_ok = Fraction(st.get("r_frame_rate", "0/1")) == fps
+        except (ValueError, ZeroDivisionError):
+            return False
+        if not (fps_ok and st.get("codec_name") == "h264" and st.get("pix_fmt") == "yuv420p"
+                and st.get("width") == w and st.get("height") == h):
+            return False
+        perfis.add((st["codec_name"], st["width"], st["height"], st["r_frame_rate"],
+                    st["pix_fmt"], st.get("time_base"), st.get("profile"), st.get("level"),
+                    st.get("sample_aspect_ratio"), st.get("extradata_hash")))
+    return len(perfis) == 1
+
+def _caminho_final(tmpdir: str, output_name: str) -> str:
+    return os.path.join(
         tmpdir,
         output_name if output_name.endswith(".mp4") else output_name + ".mp4"
     )
-    shutil.copyfile(concat_out, final_out)
+
+def _entrada_audio(audio_path: str, audio_loop: bool) -> list[str]:
+    # -stream_loop -1 repete a BGM indefinidamente; o -shortest corta no fim do vídeo
+    cmd = ["-stream_loop", "-1"] if audio_loop else []
+    return [*cmd, *_opcoes_entrada(audio_path), "-i", audio_path]
+
+def _concat_video_apenas_por_demuxer(
+    videos: list[dict], audio_path: str | None, tmpdir: str, output_name: str,
+    abr: str, audio_gain: float, audio_loop: bool = False
+) -> str:
+    """
+    Caminho rápido: concat demuxer com -c copy direto nos originais (só remux, sem
+    decode/encode). O áudio opcional é mixado no mesmo comando.
+    """
+    # Lista do concat demuxer pelo stdin (pipe:0), sem arquivo inputs.txt. Caminhos
+    # locais levam "file:" (senão são resolvidos relativos a "pipe:"), e aspas
+    # simples no caminho/URL fecham a string da lista: ' vira '\''
+    srcs = [c["src"] if _is_http(c["src"]) else "file:" + c["src"] for c in videos]
+    lista = "".join("file '" + src.replace("'", "'\\''") + "'\n" for src in srcs)
+
+    final_out = _caminho_final(tmpdir, output_name)
+    cmd = [
+        FFMPEG_BIN, "-y",
+        "-f", "concat", "-safe", "0",
+        "-protocol_whitelist", "file,pipe,http,https,tcp,tls",
+        "-i", "pipe:0",
+    ]
+    if audio_path:
+        cmd += _entrada_audio(audio_path, audio_loop)
+    cmd += ["-map", "0:v:0", "-c:v", "copy"]
+    if audio_path:
+        cmd += [
+            "-map", "1:a:0",
+            "-c:a", "aac", "-b:a", abr,
+            "-filter:a", f"volume={audio_gain}",
+            "-shortest",
+        ]
+    else:
+        cmd += ["-an"]
+    cmd += ["-movflags", "+faststart", final_out]
+    run(cmd, lista.encode("utf-8"))
     return final_out
 
-def _mix_audio_se_houver(final_video_path: str, audio_url: str | None, tmpdir: str, abr: str, audio_gain: float) -> str:
-    if not audio_url:
-        return final_video_path
+# Os trechos fixos do comando são memoizados por perfil de saída: uma única string
+# canônica de filtro/encode por (resolução, fps, bitrate, encoder)
+@functools.lru_cache(maxsize=64)
+def _vf_normalizar(resolution: str, fps: int) -> str:
+    # Converte "1080x1920" -> (1080,1920) e monta filtro correto com ':'
+    w, h = _parse_res(resolution)
+    return (
+        f"scale={w}:{h}:force_original_aspect_ratio=decrease,"
+        f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2:color=black,"
+        f"setsar=1,"
+        f"fps={fps}"
+    )
+
+def _opcoes_corte(c: dict) -> list[str]:
+    # Corte como opções de entrada (vale só para aquele clip). "to" mantém o contrato
+    # original (-ss X -i in -to Y, com -to de saída): é a duração a partir de ss, por
+    # isso vira -t de entrada, e não -to (que na entrada seria posição absoluta)
+    cmd = []
+    if c.get("ss"):
+        cmd += ["-ss", str(c["ss"])]
+    if c.get("to"):
+        cmd += ["-t", str(c["to"])]
+    return cmd
 
-    local_audio = os.path.join(tmpdir, "audio_input")
-    download(audio_url, local_audio)
+@functools.lru_cache(maxsize=64)
+def _cauda_normalizacao(
+    resolution: str, fps: int, vbr: str, encoder: str, threads: int = 0, preset: str = ""
+) -> tuple[str, ...]:
+    vf = _vf_normalizar(resolution, fps)
+    if _vf_upload(encoder):
+        vf += "," + _vf_upload(encoder)
+    return (
+        "-vf", vf,
+        *_opcoes_encoder(encoder, vbr, threads, preset),
+        "-an",
+    )
 
-    mixed_out = os.path.join(tmpdir, "mixed.mp4")
+def _normalizar_clip(
+    c: dict, norm_path: str, resolution: str, fps: int, vbr: str, threads: int = 0,
+    preset: str = ""
+) -> str:
+    encoder = _video_encoder()
     run([
-        "ffmpeg", "-y",
-        "-i", final_video_path, "-i", local_audio,
-        "-map", "0:v:0", "-map", "1:a:0",
-        "-c:v", "copy",
-        "-c:a", "aac", "-b:a", abr,
-        "-filter:a", f"volume={audio_gain}",
-        "-shortest",
-        mixed_out
+        FFMPEG_BIN, "-y", *_opcoes_hw_device(encoder),
+        *_opcoes_corte(c),
+        *_opcoes_decode(encoder), *_opcoes_entrada(c["src"]), "-i", c["src"],
+        *_cauda_normalizacao(resolution, fps, vbr, encoder, threads, preset),
+        # Intermediário em MP4 fragmentado: escrita sequencial, sem voltar ao início
+        # para gravar o moov (o +faststart fica só no arquivo final)
+        "-f", "mp4", "-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+        norm_path
     ])
-    return mixed_out
+    return norm_path
 
-def _pipeline(data: dict) -> str:
+def _paralelismo_normalizacao(n: int) -> tuple[int, int]:
     """
-    Executa todo o pipeline e retorna o caminho do arquivo final no disco.
+    (encodes simultâneos, threads por encode). Com libx264 divide os vCPUs do job entre
+    encodes de 2 threads (x264 escala mal em clips curtos, vários encodes estreitos
+    ocupam melhor os núcleos); encoders de hardware ficam em 2 sessões por vez.
+    """
+    cpus = _cpus_por_job()
+    if NORMALIZE_WORKERS:
+        workers = NORMALIZE_WORKERS
+    elif _video_encoder() == "libx264":
+        workers = max(1, cpus // 2)
+    else:
+        workers = 2
+    workers = max(1, min(n, workers))
+    return workers, max(1, cpus // workers)
+
+def _normalizar_em_pipeline(
+    n: int, resolver, tmpdir: str, resolution: str, fps: int, vbr: str, preset: str = "",
+    cache_paths: list[str | None] | None = None
+) -> list[dict]:
+    """
+    Modo segmentado (mais de FUSED_MAX_INPUTS clips, em que um único filter_complex
+    abriria decoders demais de uma vez): normaliza clip a clip em norm_i.mp4.
+
+    Produtor/consumidores: uma thread resolve/baixa os clips (resolver(i), alguns em
+    paralelo) e os entrega em ordem numa fila curta (limita o disco em uso); um pool
+    de consumidores normaliza os clips em paralelo assim que chegam, sobrepondo
+    downloads e encodes. A ordem é preservada pelo índice; o arquivo baixado é
+    apagado logo após normalizado.
+
+    Com cache_paths, clips já normalizados em jobs anteriores são usados direto do
+    cache (nem baixados); os novos são gravados lá para os próximos jobs.
+    """
+    workers, threads = _paralelismo_normalizacao(n)
+    fila: queue.Queue = queue.Queue(maxsize=workers + 1)
+    erros: list[Exception] = []
+    cache_paths = cache_paths or [None] * n
+    norm_paths: list[str | None] = [None] * n
+
+    def produtor() -> None:
+        # Janela de `workers` downloads em paralelo (um por encoder), entregues em
+        # ordem; a janela + a fila limitam quantos arquivos baixados existem em disco
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dl") as ex:
+                janela: collections.deque = collections.deque()
+                for i in range(n):
+                    if erros:
+                        break
+                    if cache_paths[i] and os.path.exists(cache_paths[i]):
+                        os.utime(cache_paths[i])  # renova o TTL
+                        norm_paths[i] = cache_paths[i]
+                        continue
+                    janela.append((i, ex.submit(resolver, i)))
+                    if len(janela) >= workers:
+                        j, fut = janela.popleft()
+                        fila.put((j, fut.result()))
+                while janela and not erros:
+                    j, fut = janela.popleft()
+                    fila.put((j, fut.result()))
+        except Exception as e:
+            erros.append(e)
+        finally:
+            for _ in range(workers):
+                fila.put(None)
+
+    def consumidor() -> None:
+        while (item := fila.get()) is not None:
+            i, c = item
+            if erros:
+                continue  # só drena a fila até o produtor parar
+            destino = cache_paths[i]
+            if destino:
+                out = f"{destino}.{uuid.uuid4().hex}.tmp"
+            else:
+                out = os.path.join(tmpdir, f"norm_{i}.mp4")
+            try:
+                _normalizar_clip(c, out, resolution, fps, vbr, threads, preset)
+                if destino:
+                    os.replace(out, destino)  # atômico: outro job nunca lê um arquivo parcial
+                    out = destino
+                norm_paths[i] = out
+            except Exception as e:
+                erros.append(e)
+                if destino and os.path.exists(out):
+                    os.remove(out)
+            if c["src"].startswith(tmpdir + os.sep):
+                os.remove(c["src"])
+
+    t = threading.Thread(target=produtor, daemon=True)
+    t.start()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="norm") as ex:
+        for _ in range(workers):
+            ex.submit(consumidor)
+    t.join()
+
+    if erros:
+        raise erros[0]
+    return [{"src": p, "ss": None, "to": None} for p in norm_paths]
+
+def _renderizar(
+    videos: list[dict], audio_path: str | None, tmpdir: str, output_name: str,
+    resolution: str, fps: int, vbr: str, abr: str, audio_gain: float, audio_loop: bool = False,
+    preset: str = ""
+) -> str:
+    """
+    Normaliza (scale/pad/setsar/fps), concatena e mixa o áudio opcional em UM único
+    ffmpeg: um só encode, nenhum arquivo intermediário (norm/concat/mixed) em disco.
+    """
+    vf = _vf_normalizar(resolution, fps)
+    encoder = _video_encoder()
+
+    cmd = [FFMPEG_BIN, "-y", *_opcoes_hw_device(encoder)]
+    for c in videos:
+        cmd += [*_opcoes_corte(c), *_opcoes_decode(encoder), *_opcoes_entrada(c["src"]), "-i", c["src"]]
+
+    n = len(videos)
+    filter_complex = ";".join(f"[{i}:v]{vf}[v{i}]" for i in range(n))
+    filter_complex += ";" + "".join(f"[v{i}]" for i in range(n)) + f"concat=n={n}:v=1:a=0"
+    if _vf_upload(encoder):
+        filter_complex += f"[vc];[vc]{_vf_upload(encoder)}[v]"
+    else:
+        filter_complex += "[v]"
+
+    if audio_path:
+        # Áudio externo entra como a entrada N (depois dos N clips)
+        cmd += _entrada_audio(audio_path, audio_loop)
+        filter_complex += f";[{n}:a:0]volume={audio_gain}[a]"
+
+    final_out = _caminho_final(tmpdir, output_name)
+    cmd += [
+        "-filter_complex", filter_complex,
+        "-map", "[v]",
+        *_opcoes_encoder(encoder, vbr, 0, preset),
+    ]
+    if audio_path:
+        cmd += ["-map", "[a]", "-c:a", "aac", "-b:a", abr, "-shortest"]
+    else:
+        cmd += ["-an"]
+    cmd += ["-movflags", "+faststart", final_out]
+    run(cmd)
+    return final_out
+
+def _pipeline(
+    data: dict, heads: list[requests.Response | None] | None = None
+) -> tuple[str, dict | None]:
+    """
+    Executa todo o pipeline e retorna o caminho do arquivo final no disco e o
+    resultado do upload no Drive (id/webViewLink; None sem upload).
     Lança exceções em caso de erro (para o /concat_sync responder 500).
+    heads: HEADs já feitos no preflight (clips + áudio, na ordem); sem eles, refaz.
     """
     if not ffmpeg_exists():
         raise RuntimeError("ffmpeg não encontrado no container")
@@ -193,6 +974,9 @@ def _pipeline(data: dict) -> str:
     resolution    = data.get("resolution", DEFAULT_RESOLUTION)
     fps           = int(data.get("fps", DEFAULT_FPS))
     vbr           = data.get("video_bitrate", DEFAULT_VIDEO_BR)
+    preset        = data.get("preset") or ""
+    if preset and preset not in X264_PRESETS:
+        raise ValueError(f"preset inválido: {preset}")
     abr           = data.get("audio_bitrate", DEFAULT_AUDIO_BR)
     audio_url     = data.get("audio_url")
 
@@ -201,53 +985,295 @@ def _pipeline(data: dict) -> str:
     except Exception:
         audio_gain = 0.2
     audio_gain = max(0.0, min(audio_gain, 5.0))
+    audio_loop    = _flag(data.get("audio_loop"), False)
 
-    upload_flag   = bool(data.get("upload", UPLOAD_TO_DRIVE))
+    upload_flag   = _flag(data.get("upload"), UPLOAD_TO_DRIVE)
     drive_folder  = data.get("drive_folder_id", DRIVE_FOLDER_ID)
     output_name   = data.get("output_name", f"out-{uuid.uuid4().hex[:8]}.mp4")
 
-    tmpdir = tempfile.mkdtemp(prefix="ffx_")
+    _cache_evict_periodico()
+    tmpdir = None
+    info = None
     try:
-        norm_paths = _baixar_videos_normalizar_sem_audio(
-            clips=data["clips"],
-            tmpdir=tmpdir,
-            resolution=resolution,
-            fps=fps,
-            vbr=vbr,
-            abr=abr,
+        clips = data["clips"]
+        urls = _urls_dos_clips(clips)
+        heads = heads or _heads(urls + ([audio_url] if audio_url else []))
+
+        # Espaço estimado no tmpdir: entradas (se baixadas) + saída, com folga;
+        # HEAD falho/403 ou sem Content-Length deixa a estimativa indefinida
+        tamanhos = [_content_length(h) for h in heads]
+        tmpdir = tempfile.mkdtemp(
+            prefix="ffx_", dir=_tmp_base(3 * sum(tamanhos) if all(tamanhos) else None)
         )
+        segmentado = len(clips) > FUSED_MAX_INPUTS
 
-        final_out = _concat_video_apenas_por_demuxer(norm_paths, tmpdir, output_name)
-        final_with_audio = _mix_audio_se_houver(final_out, audio_url, tmpdir, abr, audio_gain)
+        # Áudio segue a mesma regra dos clips: URL direto no ffmpeg quando possível
+        audio_src = (
+            _fonte(audio_url, os.path.join(tmpdir, "audio_input"), heads[-1]) if audio_url else None
+        )
+
+        # No modo segmentado os clips não são resolvidos aqui, e sim um a um dentro
+        # do pipeline de normalização (janela de downloads, disco limitado); a
+        # checagem de cópia direta sonda as próprias URLs
+        if segmentado:
+            videos = [{"src": u, "ss": c.get("ss"), "to": c.get("to")} for u, c in zip(urls, clips)]
+        else:
+            videos = _resolver_videos(clips, urls, heads[:len(urls)], tmpdir)
+
+        chaves = [_chave_fonte(u, h) for u, h in zip(urls, heads)]
+        if _pode_copiar(videos, resolution, fps, chaves):
+            log.info("[worker] clips já uniformes: concat com -c copy (sem re-encode)")
+            if segmentado:
+                videos = _resolver_videos(clips, urls, heads[:len(urls)], tmpdir)
+            final_with_audio = _concat_video_apenas_por_demuxer(
+                videos, audio_src, tmpdir, output_name, abr, audio_gain, audio_loop
+            )
+        elif segmentado:
+            log.info("[worker] %s clips: normalizando clip a clip (pipeline)", len(clips))
+            resolver = lambda i: _resolver_clip(i, clips[i], urls[i], heads[i], tmpdir)
+            cache_norm = [
+                _cache_norm_path(urls[i], heads[i], clips[i], resolution, fps, vbr, preset)
+                for i in range(len(clips))
+            ]
+            if any(cache_norm):
+                os.makedirs(CLIP_CACHE_DIR, exist_ok=True)
+            normalizados = _normalizar_em_pipeline(
+                len(clips), resolver, tmpdir, resolution, fps, vbr, preset, cache_norm
+            )
+            final_with_audio = _concat_video_apenas_por_demuxer(
+                normalizados, audio_src, tmpdir, output_name, abr, audio_gain, audio_loop
+            )
+        else:
+            log.info("[worker] clips heterogêneos ou com corte: normalizando (re-encode)")
+            final_with_audio = _renderizar(
+                videos=videos,
+                audio_path=audio_src,
+                tmpdir=tmpdir,
+                output_name=output_name,
+                resolution=resolution,
+                fps=fps,
+                vbr=vbr,
+                abr=abr,
+                audio_gain=audio_gain,
+                audio_loop=audio_loop,
+                preset=preset,
+            )
 
         if upload_flag:
             if not drive_folder:
-                print("[worker] upload=true mas sem drive_folder_id", flush=True)
+                log.warning("[worker] upload=true mas sem drive_folder_id")
             else:
                 info = upload_to_drive(final_with_audio, os.path.basename(final_with_audio), drive_folder)
-                print("[worker] upload ok:", {
-                    "id": info.get("id"),
-                    "webViewLink": info.get("webViewLink"),
-                    "webContentLink": info.get("webContentLink"),
-                }, flush=True)
+                log.info(
+                    "[worker] upload ok: id=%s webViewLink=%s webContentLink=%s",
+                    info.get("id"), info.get("webViewLink"), info.get("webContentLink"),
+                )
         else:
-            print("[worker] arquivo final pronto (sem upload):", final_with_audio, flush=True)
+            log.info("[worker] arquivo final pronto (sem upload): %s", final_with_audio)
 
-        return final_with_audio
+        return final_with_audio, info
     except Exception as e:
-        print(f"[worker] ERRO: {e}", flush=True)
+        log.error("[worker] ERRO: %s", e)
         raise
     finally:
+        # Limpeza em segundo plano: o /concat_sync responde sem esperar os unlink()
+        if tmpdir:
+            threading.Thread(
+                target=shutil.rmtree, args=(tmpdir,), kwargs={"ignore_errors": True}, daemon=True
+            ).start()
+
+def _set_job(job_id: str, **campos) -> None:
+    with JOBS_LOCK:
+        if campos.get("status") in ("done", "error"):
+            campos["finished_at"] = time.time()
+        elif job_id not in JOBS:
+            _expirar_jobs()
+        JOBS.setdefault(job_id, {}).update(campos)
+
+def _jobs_pendentes() -> int:
+    # Jobs aceitos e ainda não finalizados (na fila ou rodando)
+    with JOBS_LOCK:
+        return sum(1 for job in JOBS.values() if job.get("status") in ("queued", "running"))
+
+def _expirar_jobs() -> None:
+    # Chamado com JOBS_LOCK: descarta jobs finalizados há mais de JOB_TTL_SECONDS,
+    # para o registro do /status não crescer sem limite num container de vida longa
+    limite = time.time() - JOB_TTL_SECONDS
+    for job_id in [j for j, job in JOBS.items() if job.get("finished_at", limite) < limite]:
+        del JOBS[job_id]
+
+def _validar_payload(data) -> str | None:
+    """
+    Checagem de tipos/faixas do payload na borda HTTP (sem dependência extra): erro
+    de digitação vira 400 na hora, e não falha do ffmpeg minutos depois.
+    Retorna a mensagem de erro ou None.
+    """
+    if not isinstance(data, dict):
+        return "payload precisa ser um objeto JSON"
+    clips = data.get("clips")
+    if not isinstance(clips, list) or not clips:
+        return "clips vazio ou inválido"
+    for i, clip in enumerate(clips):
+        if not isinstance(clip, dict):
+            return f"clip[{i}] precisa ser um objeto"
+        url = clip.get("source_url") or clip.get("url")
+        if not isinstance(url, str) or not url:
+            return f"clip[{i}] sem 'source_url'/'url' no payload"
+        for campo in ("ss", "to"):
+            valor = clip.get(campo)
+            # bool é subclasse de int: true/false passariam como 1/0
+            if valor is not None and (isinstance(valor, bool)
+                                      or not isinstance(valor, (str, int, float))):
+                return f"clip[{i}].{campo} inválido"
+
+    # Só string: _parse_res é lru_cache e lista/dict estouraria TypeError (500)
+    resolution = data.get("resolution", DEFAULT_RESOLUTION)
+    if not isinstance(resolution, str):
+        return f"resolution inválida: {resolution}"
+    try:
+        w, h = _parse_res(resolution)
+    except ValueError:
+        return f"resolution inválida: {resolution}"
+    if w <= 0 or h <= 0:
+        return f"resolution inválida: {resolution}"
+    # yuv420p (libx264 e encoders de hardware) exige largura e altura pares
+    if w % 2 or h % 2:
+        return f"resolution precisa ter largura e altura pares: {resolution}"
+    if isinstance(data.get("fps"), bool):
+        return f"fps inválido: {data['fps']}"
+    try:
+        fps = int(data.get("fps", DEFAULT_FPS))
+    except (TypeError, ValueError):
+        return f"fps inválido: {data.get('fps')}"
+    if not 1 <= fps <= 120:
+        return f"fps fora da faixa (1–120): {fps}"
+    for campo in ("video_bitrate", "audio_bitrate", "audio_url", "output_name", "drive_folder_id"):
+        if data.get(campo) is not None and not isinstance(data[campo], str):
+            return f"{campo} precisa ser string"
+    if data.get("audio_gain") is not None:
         try:
-            shutil.rmtree(tmpdir, ignore_errors=True)
-        except Exception:
-            pass
+            float(data["audio_gain"])
+        except (TypeError, ValueError):
+            return "audio_gain precisa ser numérico"
+    if data.get("preset") and data["preset"] not in X264_PRESETS:
+        return f"preset inválido: {data['preset']}"
+    nome = data.get("output_name")
+    if nome is not None and not nome.strip():
+        return "output_name vazio"
+    if nome and (os.path.basename(nome) != nome or nome in (".", "..")):
+        return "output_name não pode conter diretórios"
+    for campo in ("upload", "audio_loop"):
+        try:
+            _flag(data.get(campo), False)
+        except ValueError:
+            return f"{campo} precisa ser true/false: {data[campo]!r}"
+    return None
+
+# Assinatura do início de um arquivo Matroska/WebM
+EBML_MAGIC = b"\x1a\x45\xdf\xa3"
 
-def _run_concat_and_upload(data: dict) -> None:
+def _amostra(url: str) -> tuple[int | None, bytes]:
+    # GET só dos primeiros 64 KiB (Range): (status HTTP, bytes); (None, b"") sem conexão
     try:
-        _pipeline(data)
-    except Exception:
-        pass
+        with HTTP.get(url, headers={"Range": "bytes=0-65535"}, stream=True, timeout=10) as r:
+            return r.status_code, r.raw.read(65536) if r.ok else b""
+    except requests.RequestException:
+        return None, b""
+
+def _preflight(data: dict) -> tuple[list[str], list[requests.Response | None]]:
+    """
+    Validação rápida antes de aceitar o job, sem tocar no disco: HEAD em paralelo
+    em todas as URLs (clips + áudio). Recusa 4xx/5xx, páginas de erro (text/*),
+    entradas acima de MAX_INPUT_BYTES e jobs cuja soma passa de MAX_TOTAL_BYTES.
+    Clips sem Content-Type de vídeo (octet-stream, ausente, HEAD recusado) são
+    confirmados pelos primeiros 64 KiB: box ftyp (MP4/MOV) ou cabeçalho EBML
+    (WebM/MKV), formatos que o ffmpeg aceita no resto do pipeline. Retorna todos os erros de uma
+    vez (lista vazia = ok) e os HEADs, que o job reaproveita (_pipeline).
+    """
+    try:
+        urls = _urls_dos_clips(data["clips"])
+    except ValueError as e:
+        return [str(e)], []
+    nomes = [f"clip[{i}]" for i in range(len(urls))]
+    n_clips = len(urls)
+    if data.get("audio_url"):
+        urls.append(data["audio_url"])
+        nomes.append("audio_url")
+
+    erros = []
+    suspeitos = []
+    total = 0
+    heads = _heads(urls)
+    for i, (nome, url, head) in enumerate(zip(nomes, urls, heads)):
+        if not _is_http(url):
+            erros.append(f"{nome}: URL precisa ser http(s)")
+            continue
+        if head is None:
+            erros.append(f"{nome}: não foi possível conectar")
+            continue
+        # 405/501: servidor não implementa HEAD; 403: URLs pré-assinadas (S3/GCS)
+        # valem só para GET. Nos dois casos quem decide é o GET com Range
+        if head.status_code in (403, 405, 501):
+            if i < n_clips:
+                suspeitos.append((nome, url))
+            continue
+        if not head.ok:
+            erros.append(f"{nome}: HTTP {head.status_code}")
+            continue
+        tipo = head.headers.get("Content-Type", "").lower()
+        if tipo.startswith("text/"):
+            erros.append(f"{nome}: Content-Type {head.headers['Content-Type']} não é mídia")
+            continue
+        tamanho = _content_length(head)
+        if MAX_INPUT_BYTES and tamanho > MAX_INPUT_BYTES:
+            erros.append(f"{nome}: {tamanho} bytes (limite por entrada {MAX_INPUT_BYTES})")
+        total += tamanho
+        if i < n_clips and not tipo.startswith("video/"):
+            suspeitos.append((nome, url))
+
+    if MAX_TOTAL_BYTES and total > MAX_TOTAL_BYTES:
+        erros.append(f"entradas somam {total} bytes (limite {MAX_TOTAL_BYTES})")
+
+    if suspeitos:
+        workers = max(1, min(len(suspeitos), DOWNLOAD_WORKERS))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            amostras = list(ex.map(lambda s: _amostra(s[1]), suspeitos))
+        for (nome, _), (status, inicio) in zip(suspeitos, amostras):
+            if status is None:
+                continue  # sem conexão agora: fica para o download decidir
+            if status >= 400:
+                erros.append(f"{nome}: HTTP {status}")
+            elif b"ftyp" not in inicio and not inicio.startswith(EBML_MAGIC):
+                erros.append(f"{nome}: conteúdo não é MP4 nem WebM/MKV")
+    return erros, heads
+
+def _campos_drive(info: dict | None) -> dict:
+    # O arquivo local some com o tmpdir: para quem chamou, o que vale é o do Drive
+    if not info:
+        return {}
+    return {"drive_id": info.get("id"), "webViewLink": info.get("webViewLink")}
+
+def _pipeline_com_vaga(
+    data: dict, heads: list[requests.Response | None] | None = None
+) -> tuple[str, dict | None]:
+    # /concat_sync: roda no JOB_EXECUTOR e devolve a vaga do JOB_SLOTS ao terminar
+    try:
+        return _pipeline(data, heads)
+    finally:
+        JOB_SLOTS.release()
+
+def _run_concat_and_upload(
+    job_id: str, data: dict, heads: list[requests.Response | None] | None = None
+) -> None:
+    _set_job(job_id, status="running")
+    try:
+        out_path, info = _pipeline(data, heads)
+    except Exception as e:
+        _set_job(job_id, status="error", error=str(e))
+    else:
+        _set_job(job_id, status="done", output=os.path.basename(out_path), **_campos_drive(info))
+    finally:
+        JOB_SLOTS.release()
 
 # =========================
 # Rotas HTTP
@@ -267,13 +1293,26 @@ def healthz():
 @app.post("/concat_and_upload")
 def concat_and_upload():
     data = request.get_json(force=True, silent=False)
-    clips = (data or {}).get("clips") or []
-    if not isinstance(clips, list) or not clips:
-        return jsonify({"ok": False, "error": "clips vazio ou inválido"}), 400
+    erro = _validar_payload(data)
+    erros, heads = ([erro], None) if erro else _preflight(data)
+    if erros:
+        return jsonify({"ok": False, "error": "; ".join(erros), "errors": erros}), 400
+
+    if not JOB_SLOTS.acquire(blocking=False):
+        return jsonify({"ok": False, "error": "fila cheia, tente novamente"}), 429, {"Retry-After": "30"}
 
     job_id = uuid.uuid4().hex[:12]
-    threading.Thread(target=_run_concat_and_upload, args=(data,), daemon=True).start()
-    return jsonify({"status": "accepted", "job_id": job_id}), 202
+    _set_job(job_id, status="queued")
+    JOB_EXECUTOR.submit(_run_concat_and_upload, job_id, data, heads)
+    return jsonify({"status": "accepted", "job_id": job_id, "queue_depth": _jobs_pendentes()}), 202
+
+@app.get("/status/<job_id>")
+def job_status(job_id: str):
+    with JOBS_LOCK:
+        job = dict(JOBS.get(job_id) or {})
+    if not job:
+        return jsonify({"ok": False, "error": "job não encontrado"}), 404
+    return jsonify({"job_id": job_id, **job}), 200
 
 @app.post("/concat_sync")
 def concat_sync():
@@ -282,16 +1321,40 @@ def concat_sync():
     """
     try:
         data = request.get_json(force=True, silent=False)
-        clips = (data or {}).get("clips") or []
-        if not isinstance(clips, list) or not clips:
-            return jsonify({"ok": False, "error": "clips vazio ou inválido"}), 400
+        erro = _validar_payload(data)
+        erros, heads = ([erro], None) if erro else _preflight(data)
+        if erros:
+            return jsonify({"ok": False, "error": "; ".join(erros), "errors": erros}), 400
 
-        out_path = _pipeline(data)
-        return jsonify({"ok": True, "message": "done", "output": os.path.basename(out_path)}), 200
+        # Mesmas vagas e mesmo pool dos jobs assíncronos: as threads do gunicorn não
+        # rodam pipelines além de PIPELINE_WORKERS (o _cpus_por_job conta com isso)
+        if not JOB_SLOTS.acquire(blocking=False):
+            return jsonify({"ok": False, "error": "fila cheia, tente novamente"}), 429, {"Retry-After": "30"}
+        out_path, info = JOB_EXECUTOR.submit(_pipeline_com_vaga, data, heads).result()
+        return jsonify({
+            "ok": True, "message": "done", "output": os.path.basename(out_path), **_campos_drive(info)
+        }), 200
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
+# Boot: verifica o ffmpeg, detecta o encoder uma vez e expira entradas antigas
+# do cache de fontes
+if not ffmpeg_exists():
+    log.warning("[boot] ffmpeg não encontrado no PATH")
+else:
+    log.info("[boot] encoder de vídeo: %s", _video_encoder())
+_cache_evict()
+_cache_evict_ultimo = time.time()
+
+# Com upload configurado, importa as libs do Google e monta o client do Drive já no
+# boot (antes do fork do --preload), e não no primeiro job. Síncrono de propósito:
+# uma thread em andamento no fork deixaria locks de import presos no worker
+if UPLOAD_TO_DRIVE or DRIVE_FOLDER_ID:
+    try:
+        _drive()
+    except Exception as e:
+        log.warning("[boot] client do Drive não inicializado: %s", e)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "8080"))
     app.run(host="0.0.0.0", port=port)
-PY
@@ -0,0 +1,238 @@
+# Testes de download (Range/sem Range/leitura curta), preflight e validação do
+# payload, contra um servidor HTTP local (sem rede externa e sem ffmpeg)
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app
+
+GRANDE = os.urandom(100_000)
+MP4 = b"\x00\x00\x00\x20ftypisom" + b"\x00" * 2000
+WEBM = app.EBML_MAGIC + b"\x00" * 2000
+
+# nome -> (conteúdo, Content-Type)
+ARQUIVOS = {
+    "grande.bin": (GRANDE, "application/octet-stream"),
+    "a.mp4": (MP4, "video/mp4"),
+    "a.bin": (MP4, "application/octet-stream"),
+    "w.bin": (WEBM, "application/octet-stream"),
+    "lixo.bin": (b"\x00" * 2000, "application/octet-stream"),
+    "pagina.html": (b"<html></html>", "text/html"),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    /<modo>/<arquivo>. Modos: ok (Range normal), norange (anuncia Range no HEAD mas
+    responde 200 no GET), short (206 com metade do trecho pedido), signed (HEAD 403,
+    GET normal, como URL pré-assinada de S3/GCS).
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._responder(corpo=False)
+
+    def do_GET(self):
+        self._responder(corpo=True)
+
+    def _responder(self, corpo: bool) -> None:
+        modo, _, nome = self.path.lstrip("/").partition("/")
+        if nome not in ARQUIVOS:
+            self.send_error(404)
+            return
+        if modo == "signed" and not corpo:
+            self.send_response(403)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        dados, tipo = ARQUIVOS[nome]
+        inicio, fim, status = 0, len(dados) - 1, 200
+        rng = self.headers.get("Range")
+        if corpo and rng and modo != "norange":
+            a, _, b = rng[len("bytes="):].partition("-")
+            inicio, fim, status = int(a), min(int(b) if b else fim, fim), 206
+            if modo == "short":
+                fim = inicio + (fim - inicio) // 2
+        trecho = dados[inicio:fim + 1]
+
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(trecho)))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {inicio}-{fim}/{len(dados)}")
+        self.end_headers()
+        if corpo:
+            self.wfile.write(trecho)
+
+
+@pytest.fixture(scope="module")
+def servidor():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+
+
+@pytest.fixture
+def em_partes(monkeypatch):
+    # Força o caminho de download em partes para arquivos pequenos
+    monkeypatch.setattr(app, "DOWNLOAD_PART_MIN", 1024)
+    monkeypatch.setattr(app, "DOWNLOAD_PARTS", 4)
+
+
+# =========================
+# download
+# =========================
+def test_download_em_partes(servidor, em_partes, tmp_path):
+    url = f"{servidor}/ok/grande.bin"
+    destino = tmp_path / "grande.bin"
+    app.download(url, str(destino), app._head(url))
+    assert destino.read_bytes() == GRANDE
+
+
+def test_download_range_ignorado_no_get_cai_para_get_unico(servidor, em_partes, tmp_path):
+    url = f"{servidor}/norange/grande.bin"
+    destino = tmp_path / "grande.bin"
+    app.download(url, str(destino), app._head(url))
+    assert destino.read_bytes() == GRANDE
+
+
+def test_download_parte_curta_falha(servidor, em_partes, tmp_path):
+    url = f"{servidor}/short/grande.bin"
+    with pytest.raises(RuntimeError, match="download incompleto"):
+        app.download(url, str(tmp_path / "grande.bin"), app._head(url))
+
+
+def test_download_sem_head(servidor, em_partes, tmp_path):
+    destino = tmp_path / "grande.bin"
+    app.download(f"{servidor}/ok/grande.bin", str(destino))
+    assert destino.read_bytes() == GRANDE
+
+
+# =========================
+# preflight
+# =========================
+def test_preflight_aceita_midia_valida(servidor):
+    clips = [
+        {"url": f"{servidor}/ok/a.mp4"},
+        {"url": f"{servidor}/ok/a.bin"},     # octet-stream com ftyp
+        {"url": f"{servidor}/ok/w.bin"},     # octet-stream com EBML (WebM/MKV)
+        {"url": f"{servidor}/signed/a.mp4"},  # HEAD 403, GET ok
+    ]
+    erros, heads = app._preflight({"clips": clips, "audio_url": f"{servidor}/ok/a.bin"})
+    assert erros == []
+    assert len(heads) == 5
+
+
+def test_preflight_agrega_todos_os_erros(servidor):
+    clips = [
+        {"url": f"{servidor}/ok/nada.mp4"},
+        {"url": f"{servidor}/ok/pagina.html"},
+        {"url": f"{servidor}/ok/lixo.bin"},
+        {"url": f"{servidor}/signed/nada.mp4"},
+    ]
+    erros, _ = app._preflight({"clips": clips, "audio_url": "ftp://x/bgm.mp3"})
+    assert len(erros) == 5
+    assert "clip[0]: HTTP 404" in erros
+    assert any(e.startswith("clip[1]: Content-Type text/html") for e in erros)
+    assert any(e.startswith("clip[2]: conteúdo não é MP4") for e in erros)
+    assert "clip[3]: HTTP 404" in erros
+    assert "audio_url: URL precisa ser http(s)" in erros
+
+
+def test_preflight_limite_por_entrada(servidor, monkeypatch):
+    monkeypatch.setattr(app, "MAX_INPUT_BYTES", 1000)
+    monkeypatch.setattr(app, "MAX_TOTAL_BYTES", 0)
+    erros, _ = app._preflight({"clips": [{"url": f"{servidor}/ok/a.mp4"}]})
+    assert erros == [f"clip[0]: {len(MP4)} bytes (limite por entrada 1000)"]
+
+
+def test_preflight_limite_total(servidor, monkeypatch):
+    monkeypatch.setattr(app, "MAX_INPUT_BYTES", 0)
+    monkeypatch.setattr(app, "MAX_TOTAL_BYTES", 3000)
+    erros, _ = app._preflight({"clips": [{"url": f"{servidor}/ok/a.mp4"}] * 2})
+    assert erros == [f"entradas somam {2 * len(MP4)} bytes (limite 3000)"]
+
+
+def test_rota_devolve_lista_de_erros(servidor):
+    cliente = app.app.test_client()
+    r = cliente.post("/concat_sync", json={"clips": [
+        {"url": f"{servidor}/ok/nada.mp4"}, {"url": f"{servidor}/ok/lixo.bin"},
+    ]})
+    assert r.status_code == 400
+    assert len(r.json["errors"]) == 2
+    assert r.json["error"] == "; ".join(r.json["errors"])
+
+
+# =========================
+# _validar_payload / _flag
+# =========================
+CLIPS = [{"url": "https://exemplo/a.mp4"}]
+
+
+@pytest.mark.parametrize("extra", [
+    {},
+    {"resolution": "720x1280", "fps": 30},
+    {"resolution": "1080:1920", "fps": "24"},
+    {"upload": "false", "audio_loop": "TRUE"},
+    {"upload": True, "drive_folder_id": "pasta"},
+    {"clips": [{"source_url": "https://exemplo/a.mp4", "ss": "1.5", "to": 3}]},
+    {"output_name": "final.mp4", "preset": "veryfast", "audio_gain": "0.5"},
+])
+def test_validar_payload_aceita(extra):
+    assert app._validar_payload({"clips": CLIPS, **extra}) is None
+
+
+@pytest.mark.parametrize("payload", [
+    [],
+    {"clips": []},
+    {"clips": ["https://exemplo/a.mp4"]},
+    {"clips": [{"ss": "1"}]},
+    {"clips": [{"url": "https://exemplo/a.mp4", "ss": True}]},
+    {"clips": [{"url": "https://exemplo/a.mp4", "to": [1]}]},
+    {"clips": CLIPS, "resolution": ["1080", "1920"]},
+    {"clips": CLIPS, "resolution": {"w": 1080}},
+    {"clips": CLIPS, "resolution": "0x0"},
+    {"clips": CLIPS, "resolution": "-2x10"},
+    {"clips": CLIPS, "resolution": "1080x1921"},
+    {"clips": CLIPS, "resolution": "abc"},
+    {"clips": CLIPS, "fps": True},
+    {"clips": CLIPS, "fps": 0},
+    {"clips": CLIPS, "fps": "x"},
+    {"clips": CLIPS, "upload": "no"},
+    {"clips": CLIPS, "upload": 1},
+    {"clips": CLIPS, "audio_loop": []},
+    {"clips": CLIPS, "output_name": ""},
+    {"clips": CLIPS, "output_name": "../x.mp4"},
+    {"clips": CLIPS, "audio_gain": "alto"},
+    {"clips": CLIPS, "preset": "turbo"},
+    {"clips": CLIPS, "audio_url": 5},
+])
+def test_validar_payload_recusa(payload):
+    assert app._validar_payload(payload)
+
+
+def test_rota_payload_invalido_e_400_e_nao_500():
+    r = app.app.test_client().post("/concat_and_upload", json={"clips": CLIPS, "resolution": [1080]})
+    assert r.status_code == 400
+
+
+@pytest.mark.parametrize("valor, padrao, esperado", [
+    (None, True, True), (None, False, False), (True, False, True), (False, True, False),
+    ("true", False, True), ("false", True, False), (" True ", False, True),
+])
+def test_flag(valor, padrao, esperado):
+    assert app._flag(valor, padrao) is esperado
+
+
+@pytest.mark.parametrize("valor", ["no", "1", 1, 0, [], {}])
+def test_flag_recusa(valor):
+    with pytest.raises(ValueError):
+        app._flag(valor, False)